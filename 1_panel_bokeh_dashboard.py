@@ -20,67 +20,145 @@
 # - https://github.com/pyviz-demos/glaciers
 
 # +
+import os
 from pathlib import Path
 
 import holoviews as hv
+import numpy as np
 import pandas as pd
 import panel as pn
 from bokeh.models import HoverTool
 hv.extension("bokeh")
+hv.renderer("bokeh").webgl = True
 # -
 
 # ## Get and preprocess datasets
 #
 # - Converting some column types.
+# - Downcasting numeric columns to reduce memory usage.
 # - Clipping some columns to avoid irrelevant outliers.
 # - Creating columns for direct plotting.
+#
+# When served with `panel serve`, the datasets are only loaded by the first session.
 
 DATA_DIR = Path("data/")
 
-albums = pd.read_json(DATA_DIR / "albums_features.json")
-artists = pd.read_json(DATA_DIR / "artists_features.json")
 
-albums["name"] = albums["name"].astype(str)
-albums["release_date"] = pd.to_datetime(albums.release_date)
-albums["year"] = albums.release_date.dt.year
-albums["decade"] = albums.year.astype(str).str[:3] + "0"
-albums["loudness"] = albums.loudness.clip(
-    albums.loudness.quantile(0.05), albums.loudness.quantile(0.95)
-)
+def read_dataset(name):
+    """Reads a dataset from its JSON file, caching it as Parquet for later runs."""
+    json_path = DATA_DIR / f"{name}.json"
+    parquet_path = DATA_DIR / f"{name}.parquet"
+    cache_is_fresh = (
+        parquet_path.exists()
+        and parquet_path.stat().st_mtime >= json_path.stat().st_mtime
+    )
+    if cache_is_fresh:
+        return pd.read_parquet(parquet_path)
+    data = pd.read_json(json_path)
+    # write to a temporary file so that concurrent readers never see a partial file
+    tmp_path = DATA_DIR / f"{name}.parquet.{os.getpid()}.tmp"
+    try:
+        data.to_parquet(tmp_path)
+        os.replace(tmp_path, parquet_path)
+    except Exception:
+        # the cache is optional, e.g. the data directory can be read-only
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return data
+
+
+def load_datasets():
+    """Reads and preprocesses the albums and artists datasets."""
+    albums = read_dataset("albums_features")
+    artists = read_dataset("artists_features")
+
+    albums["name"] = albums["name"].astype(str)
+    albums["artist_name"] = albums["artist_name"].astype("category")
+    albums["release_date"] = pd.to_datetime(albums.release_date)
+    albums["year"] = albums.release_date.dt.year
+    albums["decade"] = (albums.year // 10 * 10).astype(str).astype("category")
+    lo, hi = albums["loudness"].quantile([0.05, 0.95]).to_numpy()
+    albums["loudness"] = albums["loudness"].clip(lo, hi)
+    float_columns = [
+        "danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+        "instrumentalness", "liveness", "valence", "tempo", "time_signature"
+    ]
+    albums[float_columns] = albums[float_columns].astype("float32")
+    albums[["popularity", "total_tracks"]] = albums[["popularity", "total_tracks"]].astype("int16")
+    albums["duration_ms"] = albums["duration_ms"].astype("int32")
+
+    return albums, artists
+
+
+# When served, preprocessed datasets are shared by all sessions of the server process.
+# `pn.state.cache` only exists from panel 0.7, so it is created if missing.
+# In a notebook the datasets are always reloaded to pick up any change.
+if pn.state.curdoc is None:
+    albums, artists = load_datasets()
+else:
+    if not hasattr(pn.state, "cache"):
+        pn.state.cache = {}
+    if "datasets" not in pn.state.cache:
+        pn.state.cache["datasets"] = load_datasets()
+    albums, artists = pn.state.cache["datasets"]
 
 
 # ## Build the main visualizations
 
+# +
+ARTISTS_TOOLTIPS = """
+<div>
+    <div>
+        <img
+            src="@image" height="70" alt="@image" width="70"
+            style="float: left; margin: 0px 15px 15px 0px;"
+            border="1"
+        ></img>
+    </div>
+    <div>
+        <span style="font-size: 15px;"><b>@name</b></span>
+    </div>
+    <div>
+        <span style="font-weight: bold;">Main genre:</span>
+        <span>@genre_cluster</span>
+    </div>
+    <div>
+        <span style="font-weight: bold;">Subgenre:</span>
+        <span>@genre_specific</span>
+    </div>
+</div>
+"""
+ARTISTS_HOVER = HoverTool(tooltips=ARTISTS_TOOLTIPS)
+
+ALBUMS_TOOLTIPS = """
+<div>
+    <div>
+        <img
+            src="@image" height="70" alt="@image" width="70"
+            style="float: left; margin: 0px 15px 15px 0px;"
+            border="2"
+        ></img>
+    </div>
+    <div>
+        <span>@artist_name</span>
+    </div>
+    <div>
+        <span>@name</span>
+    </div>
+    <div>
+        <span>@year</span>
+    </div>
+</div>
+"""
+ALBUMS_HOVER = HoverTool(tooltips=ALBUMS_TOOLTIPS)
+# -
+
 def create_artists_points(data):
-    artists_tooltips = """
-        <div>
-            <div>
-                <img
-                    src="@image" height="70" alt="@image" width="70"
-                    style="float: left; margin: 0px 15px 15px 0px;"
-                    border="1"
-                ></img>
-            </div>
-            <div>
-                <span style="font-size: 15px;"><b>@name</b></span>
-            </div>
-            <div>
-                <span style="font-weight: bold;">Main genre:</span>
-                <span>@genre_cluster</span>
-            </div>
-            <div>
-                <span style="font-weight: bold;">Subgenre:</span>
-                <span>@genre_specific</span>
-            </div>
-        </div>
-    """
-    artists_hover = HoverTool(tooltips=artists_tooltips)
-    artists_points = hv.Points(
-        data=data, kdims=["genre_x", "genre_y"],
-        vdims=["genre_cluster", "genre_specific", "popularity", "image", "name"]
-    )
+    kdims = ["genre_x", "genre_y"]
+    vdims = ["genre_cluster", "genre_specific", "popularity", "image", "name"]
+    artists_points = hv.Points(data=data[kdims + vdims], kdims=kdims, vdims=vdims)
     artists_points.opts(
-        tools=["box_select", "lasso_select", artists_hover, "tap"],
+        tools=["box_select", "lasso_select", ARTISTS_HOVER, "tap"],
         color="genre_cluster", cmap="dark2",
         line_color="black", size=hv.dim("popularity")/5,
         padding=0.1, width=800, height=600, show_grid=False, show_frame=False,
@@ -88,50 +166,25 @@ def create_artists_points(data):
     )
     return artists_points
 
-def create_albums_points(data=None, x=None, y=None, color=None):
-    if data is None:
-        data = albums
-    x = x or x_select.value
-    y = y or y_select.value
-    color = color or color_select.value
-
-    albums_tooltips = """
-        <div>
-            <div>
-                <img
-                    src="@image" height="70" alt="@image" width="70"
-                    style="float: left; margin: 0px 15px 15px 0px;"
-                    border="2"
-                ></img>
-            </div>
-            <div>
-                <span>@artist_name</span>
-            </div>
-            <div>
-                <span>@name</span>
-            </div>
-            <div>
-                <span>@year</span>
-            </div>
-        </div>
-    """
-    albums_hover = HoverTool(tooltips=albums_tooltips)
-    albums_points = hv.Points(
-        data, [x, y],
-        ["name", "artist_name", "image", "year", color]
-    )
+def create_albums_points(data, x, y, color):
+    vdims = ["name", "artist_name", "image", "year", color]
+    # only keep plotted columns to limit the data sent to the browser
+    data = data[list(dict.fromkeys([x, y] + vdims))]
+    albums_points = hv.Points(data, [x, y], vdims)
     albums_points.opts(
-        tools=[albums_hover], color=color, cmap="viridis",
+        tools=[ALBUMS_HOVER], color=color, cmap="viridis",
         line_color="black", size=10, colorbar=True,
-        padding=0.1, width=800, height=600, title="Albums"
+        padding=0.1, width=800, height=600, title="Albums", framewise=True
     )
     return albums_points
 
 # ### Widgets
 
 # +
-genres = list(artists.genre_cluster.value_counts().index)
-decades = sorted(albums.decade.unique(), reverse=True)
+first_decade, last_decade = albums.year.min() // 10 * 10, albums.year.max() // 10 * 10
+decades = [str(decade) for decade in range(last_decade, first_decade - 1, -10)]
+decade_masks = {decade: (albums.decade == decade).to_numpy() for decade in decades}
+artist_album_indices = albums.groupby("artist_name", observed=True).indices
 columns = sorted([
     "popularity", "release_date", "total_tracks", "duration_ms", "danceability", "energy",
     "key", "loudness", "mode", "speechiness", "acousticness",
@@ -159,12 +212,17 @@ instruction = ("<div style='font-size:15px'>Select artists on the map and album
 
 # +
 artists_points = create_artists_points(artists)
-albums_points = create_albums_points(
-    x=x_select.value,
-    y=y_select.value,
-    color=color_select.value,
-    data=albums
-)
+albums_pipe = hv.streams.Pipe(data=albums)
+
+def create_albums_map():
+    return hv.DynamicMap(
+        lambda data: create_albums_points(
+            data, x_select.value, y_select.value, color_select.value
+        ),
+        streams=[albums_pipe]
+    )
+
+albums_points = create_albums_map()
 
 layout = pn.Column(
     pn.Row(
@@ -192,23 +250,29 @@ layout = pn.Column(
 
 # +
 def update(event):
+    mask = np.zeros(len(albums), dtype=bool)
+    for decade in decade_select.value:
+        mask |= decade_masks[decade]
     if artists_select.index:
         artist_names = artists_points.columns()["name"][artists_select.index]
-        data_albums = albums[albums.artist_name.isin(artist_names)]
+        indices = np.unique(np.concatenate([
+            artist_album_indices.get(name, np.array([], dtype=int)) for name in artist_names
+        ]))
+        data_albums = albums.iloc[indices[mask[indices]]]
     else:
-        data_albums = albums
-    data_albums = data_albums[data_albums.decade.isin(decade_select.value)]
-    layout[-1][-1] = create_albums_points(
-        x=x_select.value,
-        y=y_select.value,
-        color=color_select.value,
-        data=data_albums
-    )
+        data_albums = albums[mask]
+    albums_pipe.send(data_albums)
+
+def update_axes(event):
+    # axes types (e.g. datetime) are fixed when the Bokeh plot is built,
+    # so changing the axes columns needs a new plot on the same stream
+    albums_pipe.clear()
+    layout[-1][-1] = create_albums_map()
 
 artists_select = hv.streams.Selection1D(source=artists_points)
 
-x_select.param.watch(update, "value");
-y_select.param.watch(update, "value");
+x_select.param.watch(update_axes, "value");
+y_select.param.watch(update_axes, "value");
 color_select.param.watch(update, "value");
 artists_select.param.watch(update, "index");
 decade_select.param.watch(update, "value");
@@ -22,6 +22,7 @@
 # - https://altair-viz.github.io/user_guide/customization.html
 # - https://github.com/altair-viz/altair/issues/1552
 # - https://stackoverflow.com/questions/57244390/has-anyone-figured-out-a-workaround-to-add-a-subtitle-to-an-altair-generated-cha
+# - https://vega.github.io/vega-lite/docs/
 
 # +
 from pathlib import Path
@@ -33,6 +34,7 @@ import pandas as pd
 # ## Get and preprocess datasets
 #
 # - Converting some column types.
+# - Downcasting numeric columns to reduce memory usage.
 # - Clipping some columns to avoid irrelevant outliers.
 # - Creating columns for direct plotting.
 
@@ -44,89 +46,129 @@ artists = pd.read_json(DATA_DIR / "artists_features.json")
 albums["name"] = albums["name"].astype(str)
 albums["release_date"] = pd.to_datetime(albums.release_date)
 albums["year"] = albums.release_date.dt.year
-albums["decade"] = albums.year.astype(str).str[:3] + "0"
-albums["loudness"] = albums.loudness.clip(albums.loudness.quantile(0.05), albums.loudness.quantile(0.95))
+albums["decade"] = (albums.year // 10 * 10).astype(str)
+lo, hi = albums["loudness"].quantile([0.05, 0.95]).to_numpy()
+albums["loudness"] = albums["loudness"].clip(lo, hi)
+float_columns = [
+    "danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+    "instrumentalness", "liveness", "valence", "tempo", "time_signature"
+]
+albums[float_columns] = albums[float_columns].astype("float32")
+albums[["popularity", "total_tracks"]] = albums[["popularity", "total_tracks"]].astype("int16")
+albums["duration_ms"] = albums["duration_ms"].astype("int32")
 
 # ## Adapt data for simple charts
 #
 # Join artists to albums to have one unique dataset. This makes Altair interactions much easier.
+#
+# The dataset is saved to a CSV file referenced by URL in the charts, instead of being inlined in the HTML for each chart.
 
 artists_columns = ["genre_cluster", "genre_specific", "genre_x", "genre_y"]
 albums_columns = ["name", "release_date", "popularity", "loudness", "artist_uri", "artist_name"]
-data = albums[albums_columns].join(
-    artists.set_index("uri")[artists_columns],
+data = albums[albums_columns].merge(
+    artists[["uri"] + artists_columns].rename(columns={"uri": "artist_uri"}),
     on="artist_uri", how="inner"
 ).drop("artist_uri", axis=1)
 
+DATA_URL = "altair_data.csv"
+# write full timestamps, date-only strings are read as UTC and shift a day west of UTC
+data.to_csv(DATA_URL, index=False, date_format="%Y-%m-%dT%H:%M:%S")
+
 # ## Charts and interactions
+#
+# The Vega-Lite specification is written directly as dictionaries, Altair is only used to wrap and save the final chart.
 
 # +
-genres_selector = alt.selection_multi(fields=["genre_cluster"])
-artists_selector = alt.selection(type="interval")
-base_chart = alt.Chart(data)
-genres_color = alt.condition(genres_selector, alt.Color("genre_cluster:N", legend=None), alt.value("lightgray"))
-
-genres_points = base_chart.mark_point().encode(
-    y="genre_cluster:N",
-    color=genres_color,
-).add_selection(genres_selector)
-
-artists_points = base_chart.mark_point().encode(
-    x=alt.X("mean(genre_x)", axis=None),
-    y=alt.Y("mean(genre_y)", axis=None),
-    color=genres_color,
-    tooltip=["artist_name", "genre_cluster", "genre_specific"],
-).add_selection(
-    artists_selector
-)
-
-base_albums_points = base_chart.mark_point().encode(
-    x="release_date",
-    y="popularity",
-)
-
-albums_points = base_albums_points.encode(
-    color=alt.condition(
-        artists_selector,
-        alt.Color("loudness:Q", scale=alt.Scale(scheme="viridis")),
-        alt.value("lightgray")
-    ),
-)
-
-albums_tooltips = base_albums_points.encode(
-    opacity=alt.value(0),
-    tooltip=["artist_name", "name", "release_date"]
-).transform_filter(
-    artists_selector
-)
+genres_color = {
+    "condition": {"selection": "genres", "field": "genre_cluster", "type": "nominal", "legend": None},
+    "value": "lightgray",
+}
+
+genres_points = {
+    "title": "Genres",
+    "mark": "point",
+    "encoding": {
+        "y": {"field": "genre_cluster", "type": "nominal"},
+        "color": genres_color,
+    },
+    "selection": {"genres": {"type": "multi", "fields": ["genre_cluster"]}},
+}
+
+artists_points = {
+    "title": "Artists",
+    "mark": "point",
+    "encoding": {
+        "x": {"field": "genre_x", "type": "quantitative", "aggregate": "mean", "axis": None},
+        "y": {"field": "genre_y", "type": "quantitative", "aggregate": "mean", "axis": None},
+        "color": genres_color,
+        "tooltip": [
+            {"field": "artist_name", "type": "nominal"},
+            {"field": "genre_cluster", "type": "nominal"},
+            {"field": "genre_specific", "type": "nominal"},
+        ],
+    },
+    "selection": {"artists": {"type": "interval"}},
+}
+
+albums_axes = {
+    "x": {"field": "release_date", "type": "temporal"},
+    "y": {"field": "popularity", "type": "quantitative"},
+}
+
+albums_points = {
+    "mark": "point",
+    "encoding": {
+        **albums_axes,
+        "color": {
+            "condition": {
+                "selection": "artists", "field": "loudness", "type": "quantitative",
+                "scale": {"scheme": "viridis"},
+            },
+            "value": "lightgray",
+        },
+    },
+    "selection": {"zoom": {"type": "interval", "bind": "scales", "encodings": ["x", "y"]}},
+}
+
+albums_tooltips = {
+    "mark": "point",
+    "encoding": {
+        **albums_axes,
+        "opacity": {"value": 0},
+        "tooltip": [
+            {"field": "artist_name", "type": "nominal"},
+            {"field": "name", "type": "nominal"},
+            {"field": "release_date", "type": "temporal"},
+        ],
+    },
+    "transform": [{"filter": {"selection": "artists"}}],
+}
 
 # +
-title = alt.Chart(
-    {"values": [{"text": "Spotify user library explorer"}]}
-).mark_text(size=20).encode(
-    text="text:N",
-)
-
-subtitle = alt.Chart(
-    {"values": [{"text": "Click on a genre to filter artists, select artists to filter albums, albums view is zoomable"}]}
-).mark_text(size=14).encode(
-    text="text:N",
-)
+title = {
+    "data": {"values": [{"text": "Spotify user library explorer"}]},
+    "mark": {"type": "text", "size": 20},
+    "encoding": {"text": {"field": "text", "type": "nominal"}},
+}
+
+subtitle = {
+    "data": {"values": [{"text": "Click on a genre to filter artists, select artists to filter albums, albums view is zoomable"}]},
+    "mark": {"type": "text", "size": 14},
+    "encoding": {"text": {"field": "text", "type": "nominal"}},
+}
 # -
 
-chart = alt.vconcat(
-    title,
-    subtitle,
-    alt.hconcat(
-        genres_points.properties(title="Genres"),
-        artists_points.properties(title="Artists")
-    ),
-    (albums_points + albums_tooltips).interactive().properties(title="Albums")
-).configure_view(
-    stroke=None
-).configure_concat(
-    spacing=10
-)
+spec = {
+    "data": {"url": DATA_URL},
+    "vconcat": [
+        title,
+        subtitle,
+        {"hconcat": [genres_points, artists_points]},
+        {"title": "Albums", "layer": [albums_points, albums_tooltips]},
+    ],
+    "config": {"view": {"stroke": None}, "concat": {"spacing": 10}},
+}
+chart = alt.Chart.from_dict(spec)
 chart
 
 chart.save("altair_dashboard.html")
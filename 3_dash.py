@@ -1,27 +1,57 @@
+import os
 from pathlib import Path
 
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
 import pandas as pd
 import plotly.graph_objs as go
+from dash import Patch, dcc, html
 
 
 # Data
 DATA_DIR = Path("data/")
 
-albums = pd.read_json(DATA_DIR / "albums_features.json")
-artists = pd.read_json(DATA_DIR / "artists_features.json")
+
+def read_dataset(name):
+    """Reads a dataset from its JSON file, caching it as Parquet for later runs."""
+    json_path = DATA_DIR / f"{name}.json"
+    parquet_path = DATA_DIR / f"{name}.parquet"
+    cache_is_fresh = (
+        parquet_path.exists()
+        and parquet_path.stat().st_mtime >= json_path.stat().st_mtime
+    )
+    if cache_is_fresh:
+        return pd.read_parquet(parquet_path)
+    data = pd.read_json(json_path)
+    # write to a temporary file so that concurrent readers never see a partial file
+    tmp_path = DATA_DIR / f"{name}.parquet.{os.getpid()}.tmp"
+    try:
+        data.to_parquet(tmp_path)
+        os.replace(tmp_path, parquet_path)
+    except Exception:
+        # the cache is optional, e.g. the data directory can be read-only
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return data
+
+
+albums = read_dataset("albums_features")
+artists = read_dataset("artists_features")
 
 albums["name"] = albums["name"].astype(str)
 albums["release_date"] = pd.to_datetime(albums.release_date)
 albums["year"] = albums.release_date.dt.year
-albums["decade"] = albums.year.astype(str).str[:3] + "0"
-albums["loudness"] = albums.loudness.clip(
-    albums.loudness.quantile(0.05), albums.loudness.quantile(0.95)
+albums["decade"] = (albums.year // 10 * 10).astype(str)
+lo, hi = albums["loudness"].quantile([0.05, 0.95]).to_numpy()
+albums["loudness"] = albums["loudness"].clip(lo, hi)
+# only integer columns are downcast, plotly serializes float32 as long float64 text
+albums[["popularity", "total_tracks"]] = albums[["popularity", "total_tracks"]].astype(
+    "int16"
 )
+albums["duration_ms"] = albums["duration_ms"].astype("int32")
 
-decades = sorted(albums.decade.unique())
+first_decade, last_decade = albums.year.min() // 10 * 10, albums.year.max() // 10 * 10
+decades = [str(decade) for decade in range(first_decade, last_decade + 1, 10)]
+albums_by_decade = {decade: albums[albums.decade == decade] for decade in decades}
 columns = sorted(
     [
         "popularity",
@@ -63,15 +93,17 @@ app.layout = html.Div(
             id="artists-points",
             figure={
                 "data": [
-                    go.Scatter(
-                        x=group.genre_x,
-                        y=group.genre_y,
+                    go.Scattergl(
+                        x=artists.genre_x,
+                        y=artists.genre_y,
                         mode="markers",
-                        name=name,
-                        hovertext=group.name,
-                        marker=dict(size=albums["popularity"] / 5),
+                        hovertext=artists.name + " (" + artists.genre_cluster + ")",
+                        marker=dict(
+                            color=artists.genre_cluster.astype("category").cat.codes,
+                            colorscale="Viridis",
+                            size=artists.popularity / 5,
+                        ),
                     )
-                    for name, group in artists.groupby("genre_cluster")
                 ],
                 "layout": go.Layout(
                     title="Artists",
@@ -111,7 +143,24 @@ app.layout = html.Div(
             style={"width": "29%", "float": "left"},
         ),
         html.Div(
-            dcc.Graph(id="albums-points"), style={"width": "69%", "float": "right"}
+            dcc.Graph(
+                id="albums-points",
+                figure={
+                    "data": [
+                        go.Scatter(
+                            mode="markers",
+                            marker=dict(colorscale="Viridis", showscale=True),
+                        )
+                    ],
+                    "layout": go.Layout(
+                        title="Albums",
+                        hovermode="closest",
+                        xaxis=dict(zeroline=False),
+                        yaxis=dict(zeroline=False),
+                    ),
+                },
+            ),
+            style={"width": "69%", "float": "right"},
         ),
     ]
 )
@@ -130,28 +179,28 @@ def update_albums_points(
     xaxis_column_name, yaxis_column_name, color_column_name, decades_idx
 ):
     selected_decades = decades[decades_idx[0]:decades_idx[1]]
-    df = albums[albums.decade.isin(selected_decades)]
-    return {
-        "data": [
-            go.Scatter(
-                x=df[xaxis_column_name],
-                y=df[yaxis_column_name],
-                mode="markers",
-                marker=dict(
-                    color=df[color_column_name],
-                    colorscale="Viridis",
-                    showscale=True,
-                ),
-                hovertext=df.name,
-            )
-        ],
-        "layout": go.Layout(
-            title="Albums",
-            hovermode="closest",
-            xaxis=dict(zeroline=False, title=xaxis_column_name),
-            yaxis=dict(zeroline=False, title=yaxis_column_name),
-        ),
-    }
+    df = (
+        pd.concat([albums_by_decade[d] for d in selected_decades], copy=False)
+        if selected_decades
+        else albums.iloc[0:0]
+    )
+    plotted_columns = [xaxis_column_name, yaxis_column_name, color_column_name, "name"]
+    df = df[list(dict.fromkeys(plotted_columns))]
+    # only send the updated trace data and axes, not the whole figure
+    figure = Patch()
+    figure["data"][0]["x"] = df[xaxis_column_name]
+    figure["data"][0]["y"] = df[yaxis_column_name]
+    figure["data"][0]["marker"]["color"] = df[color_column_name]
+    figure["data"][0]["hovertext"] = df.name
+    figure["layout"]["xaxis"]["title"] = xaxis_column_name
+    figure["layout"]["yaxis"]["title"] = yaxis_column_name
+    # plotly.js stores the detected axis types and ranges (e.g. after a zoom) in the
+    # layout, reset them so that they are computed again for the new data
+    figure["layout"]["xaxis"]["type"] = "-"
+    figure["layout"]["yaxis"]["type"] = "-"
+    figure["layout"]["xaxis"]["autorange"] = True
+    figure["layout"]["yaxis"]["autorange"] = True
+    return figure
 
 
 if __name__ == "__main__":